@@ -1,6 +1,18 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from app.routers import translate
+from app.services.llm_service import get_llm_service
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    service = await get_llm_service()
+    await service.aclose()
+
 
-app = FastAPI(title="askadb - NL to Query")
+app = FastAPI(title="askadb - NL to Query", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.include_router(translate.router, prefix="/translate", tags=["Translate"])
@@ -5,4 +5,4 @@ class QueryRequest(BaseModel):
     question: str
     schema: Optional[Dict[str, Any]] = None
     context: Optional[str] = None
-    examples: Optional[List[Dict[str, str]]] = None
+    examples: Optional[List[Dict[str, Any]]] = None
@@ -1,16 +1,17 @@
-from fastapi import APIRouter, HTTPException
+import orjson
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from app.models.query_request import QueryRequest
 from app.models.query_response import QueryResponse
-from app.services.llm_service import LLMService
+from app.services.llm_service import LLMService, get_llm_service
 
 router = APIRouter()
-llm_service = LLMService()
 
 @router.post("/", response_model=QueryResponse)
-async def translate_nl_to_query(request: QueryRequest):
+async def translate_nl_to_query(request: QueryRequest, llm_service: LLMService = Depends(get_llm_service)):
     """Convert natural language question to SQL query"""
     try:
-        result = llm_service.generate_query(request)
+        result = await llm_service.generate_query(request)
         
         return QueryResponse(
             query=result["query"],
@@ -21,3 +22,13 @@ async def translate_nl_to_query(request: QueryRequest):
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error translating query: {str(e)}")
+
+
+@router.post("/stream")
+async def translate_nl_to_query_stream(request: QueryRequest, llm_service: LLMService = Depends(get_llm_service)):
+    """Stream the SQL query as server-sent events while it is generated"""
+    async def events():
+        async for event in llm_service.stream_query(request):
+            yield f"data: {orjson.dumps(event).decode()}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
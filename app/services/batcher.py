@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+Completion = Callable[..., Awaitable[Any]]
+
+
+class CompletionBatcher:
+    """Micro-batcher for chat completion calls.
+
+    Requests arriving within ``window`` seconds (or until ``max_batch``
+    accumulate) are drained together and issued concurrently with
+    ``asyncio.gather``. Each batch is dispatched as its own task, so the next
+    batch starts draining while earlier ones are still waiting on the
+    provider. Requests with identical parameters in the same batch share a
+    single provider call.
+    """
+
+    def __init__(self, create: Completion, window: float = 0.025, max_batch: int = 16):
+        self._create = create
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._dispatches: Set[asyncio.Task] = set()
+        self._pending: Set[asyncio.Future] = set()
+
+    async def submit(self, params: Dict[str, Any]) -> Any:
+        """Queue one completion and wait for its response."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Queues and tasks are bound to the loop that created them
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = None
+            self._dispatches = set()
+            self._pending = set()
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+        
+        future = loop.create_future()
+        key = orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+        self._pending.add(future)
+        try:
+            await self._queue.put((key, params, future))
+            return await future
+        finally:
+            self._pending.discard(future)
+
+    async def close(self) -> None:
+        """Stop the worker and in-flight batches, failing every open request."""
+        tasks = list(self._dispatches)
+        if self._worker is not None and not self._worker.done():
+            tasks.append(self._worker)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker = None
+        self._dispatches.clear()
+        
+        while self._queue is not None and not self._queue.empty():
+            self._queue.get_nowait()
+        for future in self._pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Completion batcher closed"))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = loop.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[bytes, Dict[str, Any], asyncio.Future]]) -> None:
+        groups: Dict[bytes, Tuple[Dict[str, Any], List[asyncio.Future]]] = {}
+        for key, params, future in batch:
+            groups.setdefault(key, (params, []))[1].append(future)
+        
+        responses = await asyncio.gather(
+            *(self._create(**params) for params, _ in groups.values()),
+            return_exceptions=True
+        )
+        for (_, futures), response in zip(groups.values(), responses):
+            for future in futures:
+                if future.done():
+                    continue
+                if isinstance(response, BaseException):
+                    future.set_exception(response)
+                else:
+                    future.set_result(response)
+        logger.debug(f"Dispatched {len(batch)} completions as {len(groups)} calls")
@@ -0,0 +1,185 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Sequence
+
+import numpy as np
+import orjson
+from cachetools import TTLCache
+
+try:
+    from redis import asyncio as redis
+except ImportError:  # Redis tier is optional
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase and collapse whitespace so trivially different phrasings match."""
+    return " ".join(question.lower().split())
+
+
+def hash_payload(payload: Any) -> str:
+    """Stable blake2b digest of a JSON-serializable value."""
+    try:
+        encoded = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    except TypeError:
+        # orjson rejects e.g. integers beyond 64 bits; the stdlib encoder does not
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(encoded).hexdigest()
+
+
+class ResponseCache:
+    """Exact-match cache for generated query results.
+
+    A process-local TTL cache sits in front of an optional Redis tier
+    (enabled through ``REDIS_URL``) so identical questions are answered
+    without another LLM round trip. The Redis tier uses the asyncio client,
+    so ``get`` and ``set`` are coroutines that never block the event loop.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: int = 3600, redis_url: Optional[str] = None):
+        self.ttl = ttl
+        self._local: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._redis = None
+        redis_url = redis_url or os.getenv("REDIS_URL")
+        if redis_url and redis is not None:
+            self._redis = redis.Redis.from_url(redis_url)
+
+    @staticmethod
+    def make_key(question: str, context_key: str) -> str:
+        """Stable hash of the normalized question within a prompt context."""
+        return hash_payload({"q": normalize_question(question), "c": context_key})
+
+    @staticmethod
+    def context_key(schema_hash: str, examples: Optional[List[Dict[str, Any]]]) -> str:
+        """Stable hash of the schema and examples a cached answer depends on."""
+        if not examples:
+            return schema_hash
+        return hash_payload({"s": schema_hash, "e": examples})
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._local.get(key)
+        if value is not None or self._redis is None:
+            return value
+        try:
+            raw = await self._redis.get(f"nlq:{key}")
+        except Exception as e:
+            logger.warning(f"Redis cache lookup failed: {e}")
+            return None
+        if raw is None:
+            return None
+        value = orjson.loads(raw)
+        with self._lock:
+            self._local[key] = value
+        return value
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._local[key] = value
+        if self._redis is None:
+            return
+        try:
+            await self._redis.setex(f"nlq:{key}", self.ttl, orjson.dumps(value))
+        except Exception as e:
+            logger.warning(f"Redis cache write failed: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._local.clear()
+
+    async def aclose(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+class _VectorBucket:
+    """Fixed-capacity ring of unit vectors and the results they map to."""
+
+    def __init__(self, dim: int, maxsize: int):
+        self.maxsize = maxsize
+        # Start with one row and double on demand so one-off contexts stay small
+        self.vectors = np.empty((1, dim), dtype=np.float32)
+        self.results: List[Dict[str, Any]] = []
+        self.inserted = 0
+
+    def search(self, vector: np.ndarray):
+        size = len(self.results)
+        scores = self.vectors[:size] @ vector
+        best = int(np.argmax(scores))
+        return float(scores[best]), self.results[best]
+
+    def add(self, vector: np.ndarray, result: Dict[str, Any]) -> None:
+        slot = self.inserted % self.maxsize
+        if slot >= len(self.vectors):
+            grown = np.empty((min(len(self.vectors) * 2, self.maxsize), self.vectors.shape[1]), dtype=np.float32)
+            grown[: len(self.vectors)] = self.vectors
+            self.vectors = grown
+        self.vectors[slot] = vector
+        if slot < len(self.results):
+            self.results[slot] = result
+        else:
+            self.results.append(result)
+        self.inserted += 1
+
+
+class SemanticCache:
+    """Nearest-neighbour cache over question embeddings.
+
+    Entries are partitioned by schema hash, so a paraphrased question only
+    reuses an answer generated against the same schema and examples. Vectors
+    are normalized on insert, making the inner product a cosine similarity.
+    ``maxsize`` bounds the vector rows allocated across all partitions; the
+    least recently used partition is dropped when a new one would exceed it.
+    """
+
+    def __init__(self, threshold: float = 0.93, maxsize: int = 10_000):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, _VectorBucket]" = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: Sequence[float], schema_hash: str) -> Optional[Dict[str, Any]]:
+        vector = self._normalize(embedding)
+        with self._lock:
+            bucket = self._buckets.get(schema_hash)
+            if bucket is None:
+                return None
+            self._buckets.move_to_end(schema_hash)
+            score, result = bucket.search(vector)
+        return result if score >= self.threshold else None
+
+    def add(self, embedding: Sequence[float], schema_hash: str, result: Dict[str, Any]) -> None:
+        vector = self._normalize(embedding)
+        with self._lock:
+            bucket = self._buckets.get(schema_hash)
+            if bucket is None:
+                bucket = self._buckets[schema_hash] = _VectorBucket(len(vector), self.maxsize)
+                self._rows += len(bucket.vectors)
+            self._buckets.move_to_end(schema_hash)
+            rows = len(bucket.vectors)
+            bucket.add(vector, result)
+            self._rows += len(bucket.vectors) - rows
+            # The bucket just written is last, so it is never the one evicted
+            while self._rows > self.maxsize and len(self._buckets) > 1:
+                _, evicted = self._buckets.popitem(last=False)
+                self._rows -= len(evicted.vectors)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+            self._rows = 0
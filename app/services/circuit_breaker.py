@@ -0,0 +1,48 @@
+import time
+import threading
+from collections import deque
+from typing import Callable, Deque, Optional, Tuple
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when calls are short-circuited after too many failures."""
+
+
+class CircuitBreaker:
+    """Error-rate circuit breaker over a sliding time window.
+
+    The circuit opens when more than ``failure_rate`` of at least
+    ``min_calls`` calls in the last ``window`` seconds failed, and closes
+    again with a fresh window after ``reset_timeout`` seconds.
+    """
+
+    def __init__(self, failure_rate: float = 0.2, window: float = 30.0, min_calls: int = 5,
+                 reset_timeout: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.failure_rate = failure_rate
+        self.window = window
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._clock() - self._opened_at < self.reset_timeout:
+                return False
+            self._opened_at = None
+            self._calls.clear()
+            return True
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            now = self._clock()
+            self._calls.append((now, success))
+            while self._calls and now - self._calls[0][0] > self.window:
+                self._calls.popleft()
+            failures = sum(1 for _, ok in self._calls if not ok)
+            if len(self._calls) >= self.min_calls and failures / len(self._calls) > self.failure_rate:
+                self._opened_at = now
@@ -1,211 +1,589 @@
 import os
-import json
-from typing import Dict, List, Any, Optional
-from openai import OpenAI
+import re
+import time
+from functools import cached_property, lru_cache
+from itertools import combinations
+from typing import AsyncIterator, Dict, FrozenSet, List, Any, Optional, Tuple
+import httpx
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, RateLimitError
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, stop_after_delay, wait_exponential_jitter
 import logging
+from dataclasses import dataclass
+
+from app.services.batcher import CompletionBatcher
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.services.cache_service import ResponseCache, SemanticCache, hash_payload, normalize_question
 
 logger = logging.getLogger(__name__)
 
+# Prompt sections that never change between requests live at module level so
+# every chat completion starts with the same byte-identical prefix, which lets
+# OpenAI's automatic prompt caching reuse the prefill across calls.
+SYSTEM_PROMPT = "You are an expert analytics engineer. Convert natural language questions into production-grade SQL for SQLite. Prefer aggregated, decision-ready results that are easy to visualize."
+
+GUIDELINES = """Instructions:
+- Return ONLY the SQL query that answers the question. No markdown, no explanations.
+- Use SELECT-only queries compatible with SQLite.
+- Prefer aggregated results (SUM of measures) and GROUP BY all non-aggregated columns.
+- Detect intent and structure the SQL accordingly:
+  - Growth/variação/evolução/tendência: SELECT time period (e.g., month) and SUM(metric), GROUP BY period (and any secondary category if present). Do NOT compute growth in SQL; just return the aggregated time series for the visualization layer to compute.
+  - Proporção/participação/percentual: SELECT category and SUM(metric), GROUP BY category.
+  - Comparar duas dimensões (ex.: produto e região): SELECT both dimensions and SUM(metric), GROUP BY both.
+  - Ranking/top/bottom: ORDER BY aggregated metric and add LIMIT (e.g., 5 ou 10).
+- Choose a single main measure relevant to the question: prefer sales_amount; fallback to quantity.
+- Keep column names as in the schema (product, region, month, sales_amount, quantity).
+- Avoid SELECT *; select only necessary columns.
+- Do not filter months unless the question specifies; keep the full range available.
+- Apply filters only for values the question names explicitly (a month, a region, a product); put them in WHERE, never in HAVING.
+- Quote text literals with single quotes and match stored values exactly as listed in the schema notes, translating Portuguese names when needed.
+- Alias SUM(<column>) as total_<column> (e.g., total_sales_amount, total_quantity), AVG(<column>) as avg_<column> and COUNT(*) as record_count; refer to the alias when ordering by the measure.
+- When grouping by month, order chronologically with a CASE over lower(month) instead of alphabetically.
+- For "média"/average questions use AVG(metric); for "quantos registros"/count questions use COUNT(*).
+- For share/percentual questions, return the absolute SUM per category; the visualization layer computes percentages.
+- Never use INSERT, UPDATE, DELETE, DROP, ALTER, PRAGMA or ATTACH; never reference tables or columns that are not in the schema.
+- Produce a single statement without a trailing semicolon.
+"""
+
+SCHEMA_INTRO = "\nGiven the following database schema:\n\n"
+SCHEMA_HEADER = "Database Schema:\n"
+EXAMPLES_HEADER = "Examples:\n"
+
+DEFAULT_EXAMPLES = EXAMPLES_HEADER + """Question: Quero vendas por região no mês de maio
+SQL: SELECT region, SUM(sales_amount) AS total_sales_amount FROM sales WHERE month = 'May' GROUP BY region ORDER BY total_sales_amount DESC
+
+Question: Mostre os top 5 produtos por quantidade vendida
+SQL: SELECT product, SUM(quantity) AS total_quantity FROM sales GROUP BY product ORDER BY total_quantity DESC LIMIT 5
+
+Question: Compare vendas por produto e região
+SQL: SELECT product, region, SUM(sales_amount) AS total_sales_amount FROM sales GROUP BY product, region ORDER BY product, region
+
+Question: Vendas por mês ao longo do tempo
+SQL: SELECT month, SUM(sales_amount) AS total_sales_amount FROM sales GROUP BY month ORDER BY CASE lower(month)
+  WHEN 'january' THEN 1 WHEN 'february' THEN 2 WHEN 'march' THEN 3 WHEN 'april' THEN 4 WHEN 'may' THEN 5 WHEN 'june' THEN 6 WHEN 'july' THEN 7 WHEN 'august' THEN 8 WHEN 'september' THEN 9 WHEN 'october' THEN 10 WHEN 'november' THEN 11 WHEN 'december' THEN 12 ELSE 99 END
+
+Question: Quais foram as vendas da região North?
+SQL: SELECT region, SUM(sales_amount) AS total_sales_amount FROM sales WHERE region = 'North' GROUP BY region
+
+Question: Qual a participação de cada produto nas vendas?
+SQL: SELECT product, SUM(sales_amount) AS total_sales_amount FROM sales GROUP BY product ORDER BY total_sales_amount DESC
+
+Question: Quantidade vendida do Product A por mês
+SQL: SELECT month, SUM(quantity) AS total_quantity FROM sales WHERE product = 'Product A' GROUP BY month ORDER BY CASE lower(month)
+  WHEN 'january' THEN 1 WHEN 'february' THEN 2 WHEN 'march' THEN 3 WHEN 'april' THEN 4 WHEN 'may' THEN 5 WHEN 'june' THEN 6 WHEN 'july' THEN 7 WHEN 'august' THEN 8 WHEN 'september' THEN 9 WHEN 'october' THEN 10 WHEN 'november' THEN 11 WHEN 'december' THEN 12 ELSE 99 END
+
+Question: Qual a média de vendas por região em janeiro?
+SQL: SELECT region, AVG(sales_amount) AS avg_sales_amount FROM sales WHERE month = 'January' GROUP BY region ORDER BY avg_sales_amount DESC
+"""
+
+# Keyword classes used by the heuristic SQL and suggestion rules
+_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "measure": ("vendas", "sales", "amount", "quantidade"),
+    "sales": ("vendas", "sales", "amount"),
+    "quantity": ("quantidade", "quantity"),
+    "region": ("região", "region"),
+    "product": ("produto", "product"),
+    "month": ("mês", "mes", "month", "tempo", "tend", "crescimento", "variação", "evolução"),
+    "time": ("tempo", "time", "mês", "month", "crescimento", "variação", "evolução"),
+    "top": ("top", "maiores", "rank", "melhores"),
+    "ten": ("10",),
+    "five": ("5", "cinco"),
+    "complex": ("crescimento", "comparar", "compare", "variação", "evolução", "case"),
+    # Averages, counts and ascending rankings the heuristic SUM ... DESC cannot express
+    "non_sum": ("média", "media", "medio", "average", "avg", "quantos", "quantas", "número", "numero",
+                "count", "menor", "menores", "pior", "piores", "bottom"),
+}
+
+
+def _build_keyword_classes() -> Dict[str, FrozenSet[str]]:
+    classes: Dict[str, set] = {}
+    for name, words in _KEYWORDS.items():
+        for word in words:
+            classes.setdefault(word, set()).add(name)
+    # A keyword also carries the classes of every keyword it contains, so the
+    # longest match at a position implies all the shorter ones within it.
+    return {
+        word: frozenset().union(*(names for other, names in classes.items() if other in word))
+        for word in classes
+    }
+
+
+_KEYWORD_CLASSES = _build_keyword_classes()
+# Zero-width lookahead so matches are found at every position, like `in`
+_KEYWORD_RE = re.compile(
+    "(?=(" + "|".join(re.escape(w) for w in sorted(_KEYWORD_CLASSES, key=len, reverse=True)) + "))"
+)
+
+
+# Dimension sets the heuristic SQL answers as well as the LLM would
+_RULE_DIMENSIONS = {
+    frozenset({"region"}),
+    frozenset({"product"}),
+    frozenset({"month"}),
+    frozenset({"region", "product"}),
+}
+
+# Filter values the heuristic SQL cannot express (it has no WHERE clause);
+# whole words only, so "maiores" does not read as "maio"
+_FILTER_LITERAL_RE = re.compile(r"\b(?:" + "|".join((
+    "january", "february", "march", "april", "may", "june", "july", "august",
+    "september", "october", "november", "december",
+    "janeiro", "fevereiro", "março", "marco", "abril", "maio", "junho", "julho", "agosto",
+    "setembro", "outubro", "novembro", "dezembro",
+    "north", "south", "east", "west", "norte", "sul", "leste", "oeste",
+    "product a", "product b", "produto a", "produto b",
+)) + r")\b")
+_NUMBER_RE = re.compile(r"\d+")
+_LIMIT_NUMBERS = {"5", "10"}
+
+
+@lru_cache(maxsize=1024)
+def _classify(question: str) -> FrozenSet[str]:
+    """Return the keyword classes present in the question in one regex pass."""
+    hits: FrozenSet[str] = frozenset()
+    for match in _KEYWORD_RE.finditer((question or '').lower()):
+        hits |= _KEYWORD_CLASSES[match.group(1)]
+    return hits
+
+
+def _suggestions_for(hits: FrozenSet[str]) -> Dict[str, Tuple[str, ...]]:
+    """Rule-based visualization and follow-up suggestions for keyword hits."""
+    
+    # Visualization suggestions
+    if 'measure' in hits:
+        if 'region' in hits or 'product' in hits:
+            visualizations = ('bar_chart',)
+        elif 'time' in hits:
+            visualizations = ('line_chart',)
+        else:
+            visualizations = ('pie_chart',)
+    else:
+        visualizations = ('table',)
+    
+    # Follow-up questions
+    if 'region' in hits:
+        follow_up_questions = ("Quais regiões tiveram melhor performance?",
+                               "Compare vendas por região e produto")
+    elif 'product' in hits:
+        follow_up_questions = ("Qual produto teve maior crescimento?",
+                               "Mostre vendas por produto ao longo do tempo")
+    else:
+        follow_up_questions = ("Quero vendas por região no mês de maio",
+                               "Mostre os top 5 produtos por quantidade vendida")
+    
+    return {
+        "visualizations": visualizations,
+        "follow_up_questions": follow_up_questions
+    }
+
+
+# Suggestions only depend on these classes, so every combination is precomputed
+_SUGGESTION_CLASSES = frozenset({"measure", "region", "product", "time"})
+_SUGGESTION_TABLE = {
+    frozenset(combo): _suggestions_for(frozenset(combo))
+    for size in range(len(_SUGGESTION_CLASSES) + 1)
+    for combo in combinations(sorted(_SUGGESTION_CLASSES), size)
+}
+
+
+FrozenSchema = Tuple[Tuple[str, Tuple[Tuple[str, str, str], ...]], ...]
+
+
+def _freeze_schema(schema: Dict) -> FrozenSchema:
+    """Reduce a schema dict to the hashable fields used in the prompt."""
+    return tuple(
+        (
+            str(table_name),
+            tuple(
+                (str(col_name), str(col_info.get('type', 'TEXT')), str(col_info.get('description', '')))
+                for col_name, col_info in table_info.get("columns", {}).items()
+            ),
+        )
+        for table_name, table_info in schema.get("tables", {}).items()
+    )
+
+
+@lru_cache(maxsize=32)
+def _render_schema(frozen: FrozenSchema) -> str:
+    """Render a frozen schema; memoized so repeated schemas are formatted once."""
+    parts = [SCHEMA_HEADER]
+    for table_name, columns in frozen:
+        parts.append(f"\nTable: {table_name}\n")
+        for col_name, col_type, col_desc in columns:
+            parts.append(f"  - {col_name} ({col_type}): {col_desc}\n")
+    return "".join(parts)
+
+
+# Default schema if not provided; formatted once at import since it never changes
+_DEFAULT_SCHEMA = {
+    "tables": {
+        "sales": {
+            "columns": {
+                "id": {"type": "INTEGER", "description": "Primary key"},
+                "region": {"type": "TEXT", "description": "Sales region (North, South, East, West)"},
+                "product": {"type": "TEXT", "description": "Product name (Product A, Product B)"},
+                "month": {"type": "TEXT", "description": "Month name (January, February, etc.)"},
+                "sales_amount": {"type": "REAL", "description": "Total sales amount in currency"},
+                "quantity": {"type": "INTEGER", "description": "Number of units sold"},
+                "created_at": {"type": "DATETIME", "description": "Record creation timestamp"}
+            }
+        }
+    }
+}
+
+DEFAULT_SCHEMA_NOTES = """
+Notes:
+  - region values: 'North', 'South', 'East', 'West' (Norte, Sul, Leste, Oeste).
+  - product values: 'Product A', 'Product B' (Produto A, Produto B).
+  - month values are English month names: 'January' ... 'December' (janeiro = 'January', fevereiro = 'February', março = 'March', abril = 'April', maio = 'May', junho = 'June', julho = 'July', agosto = 'August', setembro = 'September', outubro = 'October', novembro = 'November', dezembro = 'December').
+  - sales_amount is the default measure for "vendas"/"faturamento"; quantity is used for "quantidade"/"unidades".
+"""
+
+# Guidelines, default schema and default examples together exceed OpenAI's
+# 1024-token minimum for prompt caching
+_DEFAULT_SCHEMA_TEXT = _render_schema(_freeze_schema(_DEFAULT_SCHEMA)) + DEFAULT_SCHEMA_NOTES
+_DEFAULT_SCHEMA_HASH = hash_payload(_DEFAULT_SCHEMA)
+
+
+def _schema_hash(schema: Dict) -> str:
+    if schema is _DEFAULT_SCHEMA:
+        return _DEFAULT_SCHEMA_HASH
+    return hash_payload(schema)
+
+@dataclass
+class _CacheLookup:
+    """Cache state resolved for one request before the LLM is called."""
+    examples: Optional[List[Dict[str, Any]]]
+    cache_key: Optional[str] = None
+    context_key: Optional[str] = None
+    embedding: Optional[List[float]] = None
+    hit: Optional[Dict[str, Any]] = None  # payload rebuilt for this request's question
+
+
 class LLMService:
     def __init__(self):
         self.api_key = os.getenv("OPENAI_API_KEY")
-        self.client = OpenAI(api_key=self.api_key) if self.api_key else None
-        self.model = "gpt-4"
+        self.model = "gpt-4o"
+        self.fast_model = "gpt-4o-mini"
+        self.temperature = 0.0
+        self.cache = ResponseCache()
+        self.embedding_model = "text-embedding-3-small"
+        self.semantic_cache = SemanticCache() if os.getenv("SEMANTIC_CACHE") == "1" else None
+        self.batcher = CompletionBatcher(self._create_completion) if os.getenv("LLM_BATCH") == "1" else None
+        self.rule_shortcut = os.getenv("RULE_SHORTCUT") == "1"
+        self.request_timeout = 10.0
+        self.retry_attempts = 3
+        self.retry_budget = 12.0
+        self.embedding_timeout = 1.0
+        self.breaker = CircuitBreaker()
         
-    def generate_query(self, request) -> Dict[str, Any]:
+    @cached_property
+    def client(self) -> Optional[AsyncOpenAI]:
+        """OpenAI client built on first use over one pooled HTTP connection set."""
+        if not self.api_key:
+            return None
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+            timeout=httpx.Timeout(30.0, connect=5.0)
+        )
+        # Retries are handled in _create_completion so they share one time budget
+        return AsyncOpenAI(api_key=self.api_key, http_client=http_client, max_retries=0)
+    
+    async def aclose(self) -> None:
+        """Release the HTTP connection pool, Redis client and batching task."""
+        if self.batcher is not None:
+            await self.batcher.close()
+        await self.cache.aclose()
+        client = self.__dict__.pop("client", None)
+        if client is not None:
+            await client.close()
+    
+    async def generate_query(self, request) -> Dict[str, Any]:
         """Generate SQL query from natural language question"""
         
-        # Default schema if not provided
-        default_schema = {
-            "tables": {
-                "sales": {
-                    "columns": {
-                        "id": {"type": "INTEGER", "description": "Primary key"},
-                        "region": {"type": "TEXT", "description": "Sales region (North, South, East, West)"},
-                        "product": {"type": "TEXT", "description": "Product name (Product A, Product B)"},
-                        "month": {"type": "TEXT", "description": "Month name (January, February, etc.)"},
-                        "sales_amount": {"type": "REAL", "description": "Total sales amount in currency"},
-                        "quantity": {"type": "INTEGER", "description": "Number of units sold"},
-                        "created_at": {"type": "DATETIME", "description": "Record creation timestamp"}
-                    }
-                }
-            }
-        }
+        schema = request.schema or _DEFAULT_SCHEMA
         
-        schema = request.schema or default_schema
+        shortcut = self._rule_based_result(request.question, schema)
+        if shortcut is not None:
+            return shortcut
         
         # If no API key, use heuristic fallback directly
         if not self.client:
-            sql_query = self._fallback_sql(request.question)
-            suggestions = self._generate_suggestions(request.question, schema)
-            return {
-                "query": sql_query,
-                "confidence": 0.7,
-                "explanation": f"Heuristic SQL for: '{request.question}'",
-                "suggested_visualizations": suggestions["visualizations"],
-                "suggested_follow_up_questions": suggestions["follow_up_questions"]
-            }
+            return self._result(request.question, schema, self._fallback_sql(request.question), 0.7,
+                                f"Heuristic SQL for: '{request.question}'")
         
-        # Build the prompt (improved)
-        prompt = self._build_prompt(request.question, schema, request.examples)
+        lookup = await self._lookup_cache(request, schema)
+        if lookup.hit is not None:
+            return lookup.hit
         
         try:
             # Generate SQL query
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an expert analytics engineer. Convert natural language questions into production-grade SQL for SQLite. Prefer aggregated, decision-ready results that are easy to visualize."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1,
-                max_tokens=600
-            )
-            
-            sql_query = response.choices[0].message.content.strip()
+            params = self._completion_params(request.question, schema, lookup.examples)
+            if self.batcher is not None:
+                response = await self.batcher.submit(params)
+            else:
+                response = await self._create_completion(**params)
             
-            # Generate suggestions
-            suggestions = self._generate_suggestions(request.question, schema)
+            choice = response.choices[0]
+            if choice.finish_reason == "length":
+                return self._truncated_result(request.question, schema)
+            sql_query = choice.message.content.strip()
             
-            return {
-                "query": sql_query,
-                "confidence": 0.95,  # High confidence for simple queries
-                "explanation": f"Generated SQL query for: '{request.question}'",
-                "suggested_visualizations": suggestions["visualizations"],
-                "suggested_follow_up_questions": suggestions["follow_up_questions"]
-            }
+            result = self._result(request.question, schema, sql_query, 0.95,  # High confidence for simple queries
+                                  f"Generated SQL query for: '{request.question}'")
+            await self._store_cache(lookup, result)
+            return result
             
         except Exception as e:
             logger.error(f"Error generating query: {e}")
             # Heuristic fallback on error
-            sql_query = self._fallback_sql(request.question)
-            suggestions = self._generate_suggestions(request.question, schema)
-            return {
-                "query": sql_query,
-                "confidence": 0.6,
-                "explanation": f"Fallback SQL due to error: {str(e)}",
-                "suggested_visualizations": suggestions["visualizations"],
-                "suggested_follow_up_questions": suggestions["follow_up_questions"]
-            }
+            return self._result(request.question, schema, self._fallback_sql(request.question), 0.6,
+                                f"Fallback SQL due to error: {str(e)}")
     
-    def _build_prompt(self, question: str, schema: Dict, examples: Optional[List] = None) -> str:
-        """Build a comprehensive prompt for SQL generation"""
-        
-        # Schema description
-        schema_desc = self._format_schema(schema)
+    async def stream_query(self, request) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the SQL query as it is generated.
+
+        Yields ``{"delta": str}`` events with SQL fragments, then a single
+        ``{"result": dict}`` event with the same payload as generate_query.
+        The final result is authoritative: if the stream fails midway it
+        carries the heuristic fallback SQL instead.
+        """
+        schema = request.schema or _DEFAULT_SCHEMA
         
-        # Examples
-        examples_text = ""
-        if examples:
-            examples_text = "\n\nExamples:\n"
-            for example in examples:
-                examples_text += f"Question: {example.get('question', '')}\n"
-                examples_text += f"SQL: {example.get('sql', '')}\n\n"
+        result = self._rule_based_result(request.question, schema)
+        if result is None and not self.client:
+            result = await self.generate_query(request)
+        elif result is None:
+            lookup = await self._lookup_cache(request, schema)
+            result = lookup.hit
+        if result is not None:
+            yield {"delta": result["query"]}
+            yield {"result": result}
+            return
         
-        # Default examples if none provided
-        if not examples:
-            examples_text = """
-Examples:
-Question: Quero vendas por região no mês de maio
-SQL: SELECT region, SUM(sales_amount) AS total_sales FROM sales WHERE month = 'May' GROUP BY region ORDER BY total_sales DESC
-
-Question: Mostre os top 5 produtos por quantidade vendida
-SQL: SELECT product, SUM(quantity) AS total_quantity FROM sales GROUP BY product ORDER BY total_quantity DESC LIMIT 5
-
-Question: Compare vendas por produto e região
-SQL: SELECT product, region, SUM(sales_amount) AS total_sales FROM sales GROUP BY product, region ORDER BY product, region
+        opened = False
+        try:
+            params = self._completion_params(request.question, schema, lookup.examples)
+            stream = await self._call_provider(
+                self.client.chat.completions.create, {**params, "stream": True}, record_success=False
+            )
+            opened = True
+            parts = []
+            finish_reason = None
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                    yield {"delta": choice.delta.content}
+            self.breaker.record(True)
+            
+            if finish_reason == "length":
+                result = self._truncated_result(request.question, schema)
+            else:
+                result = self._result(request.question, schema, "".join(parts).strip(), 0.95,
+                                      f"Generated SQL query for: '{request.question}'")
+                await self._store_cache(lookup, result)
+            
+        except Exception as e:
+            logger.error(f"Error streaming query: {e}")
+            if opened:
+                # Failures before the stream opened were already recorded
+                self.breaker.record(False)
+            result = self._result(request.question, schema, self._fallback_sql(request.question), 0.6,
+                                  f"Fallback SQL due to error: {str(e)}")
+        yield {"result": result}
+    
+    def _result(self, question: str, schema: Dict, sql_query: str, confidence: float, explanation: str) -> Dict[str, Any]:
+        """Assemble the response payload with suggestions for the question."""
+        suggestions = self._generate_suggestions(question, schema)
+        return {
+            "query": sql_query,
+            "confidence": confidence,
+            "explanation": explanation,
+            "suggested_visualizations": suggestions["visualizations"],
+            "suggested_follow_up_questions": suggestions["follow_up_questions"]
+        }
+    
+    def _truncated_result(self, question: str, schema: Dict) -> Dict[str, Any]:
+        """Heuristic fallback for a completion cut off at ``max_tokens``; never cached."""
+        logger.warning(f"Completion hit the token limit for: '{question}'")
+        return self._result(question, schema, self._fallback_sql(question), 0.6,
+                            f"Fallback SQL: generated query for '{question}' was truncated")
+    
+    async def _create_completion(self, **params):
+        return await self._call_provider(self.client.chat.completions.create, params)
+    
+    async def _call_provider(self, create, params: Dict[str, Any], record_success: bool = True,
+                             attempts: Optional[int] = None, budget: Optional[float] = None):
+        """Call the provider with per-attempt timeouts and bounded retries.
 
-Question: Vendas por mês ao longo do tempo
-SQL: SELECT month, SUM(sales_amount) AS total_sales FROM sales GROUP BY month ORDER BY CASE lower(month)
-  WHEN 'january' THEN 1 WHEN 'february' THEN 2 WHEN 'march' THEN 3 WHEN 'april' THEN 4 WHEN 'may' THEN 5 WHEN 'june' THEN 6 WHEN 'july' THEN 7 WHEN 'august' THEN 8 WHEN 'september' THEN 9 WHEN 'october' THEN 10 WHEN 'november' THEN 11 WHEN 'december' THEN 12 ELSE 99 END
-"""
+        Transient errors are retried with jittered backoff within
+        ``retry_budget`` seconds; sustained failures open the circuit
+        breaker so callers fall back to heuristic SQL immediately. Streams
+        pass ``record_success=False`` and report their outcome once consumed.
+        ``attempts`` and ``budget`` override the defaults for auxiliary calls.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit open after repeated failures")
         
-        guidelines = """
-Instructions:
-- Return ONLY the SQL. No markdown, no explanations.
-- Use SELECT-only queries compatible with SQLite.
-- Prefer aggregated results (SUM of measures) and GROUP BY all non-aggregated columns.
-- Detect intent and structure the SQL accordingly:
-  - Growth/variação/evolução/tendência: SELECT time period (e.g., month) and SUM(metric), GROUP BY period (and any secondary category if present). Do NOT compute growth in SQL; just return the aggregated time series for the visualization layer to compute.
-  - Proporção/participação/percentual: SELECT category and SUM(metric), GROUP BY category.
-  - Comparar duas dimensões (ex.: produto e região): SELECT both dimensions and SUM(metric), GROUP BY both.
-  - Ranking/top/bottom: ORDER BY aggregated metric and add LIMIT (e.g., 5 ou 10).
-- Choose a single main measure relevant to the question: prefer sales_amount; fallback to quantity.
-- Keep column names as in the schema (product, region, month, sales_amount, quantity).
-- Avoid SELECT *; select only necessary columns.
-- Do not filter months unless the question specifies; keep the full range available.
-"""
+        attempts = attempts or self.retry_attempts
+        budget = budget or self.retry_budget
+        deadline = time.monotonic() + budget
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(attempts) | stop_after_delay(budget),
+            wait=wait_exponential_jitter(multiplier=0.2, max=2.0),
+            retry=retry_if_exception_type((APITimeoutError, RateLimitError, APIConnectionError)),
+            reraise=True
+        )
+        try:
+            async for attempt in retrying:
+                with attempt:
+                    timeout = min(self.request_timeout, max(deadline - time.monotonic(), 0.1))
+                    response = await create(timeout=timeout, **params)
+        except Exception:
+            self.breaker.record(False)
+            raise
+        if record_success:
+            self.breaker.record(True)
+        return response
+    
+    def _completion_params(self, question: str, schema: Dict, examples: Optional[List] = None) -> Dict[str, Any]:
+        """Chat completion arguments shared by the plain and streaming paths."""
+        return {
+            "model": self._route_model(question),
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": self._build_prompt(question, schema, examples)}
+            ],
+            "temperature": self.temperature,
+            "max_tokens": 200,
+            "stop": ["\n\n", ";"],
+        }
+    
+    async def _lookup_cache(self, request, schema: Dict) -> _CacheLookup:
+        """Resolve prompt examples and check the exact and semantic caches."""
+        # Examples may carry a {"no_cache": true} flag instead of a question/SQL pair
+        examples = [e for e in (request.examples or []) if "no_cache" not in e] or None
+        lookup = _CacheLookup(examples=examples)
+        if self.temperature > 0 or any(e.get("no_cache") is True for e in request.examples or []):
+            return lookup
         
-        prompt = f"""Given the following database schema:
-
-{schema_desc}
-
-{examples_text}
-
-{guidelines}
+        lookup.context_key = ResponseCache.context_key(_schema_hash(schema), examples)
+        lookup.cache_key = ResponseCache.make_key(request.question, lookup.context_key)
+        entry = await self.cache.get(lookup.cache_key)
+        if entry is None and self.semantic_cache is not None:
+            lookup.embedding = await self._embed(request.question)
+            if lookup.embedding is not None:
+                entry = self.semantic_cache.lookup(lookup.embedding, lookup.context_key)
+        if entry is not None:
+            # Only the SQL is shared; explanation and suggestions follow the asking question
+            lookup.hit = self._result(request.question, schema, entry["query"], entry["confidence"],
+                                      f"Cached SQL query for: '{request.question}'")
+        return lookup
+    
+    async def _store_cache(self, lookup: _CacheLookup, result: Dict[str, Any]) -> None:
+        if lookup.cache_key is None:
+            return
+        entry = {"query": result["query"], "confidence": result["confidence"]}
+        await self.cache.set(lookup.cache_key, entry)
+        if lookup.embedding is not None:
+            self.semantic_cache.add(lookup.embedding, lookup.context_key, entry)
+    
+    def _rule_based_result(self, question: str, schema: Dict) -> Optional[Dict[str, Any]]:
+        """Answer unambiguous questions on the default schema without the LLM."""
+        if not self.rule_shortcut or schema is not _DEFAULT_SCHEMA:
+            return None
+        sql_query = self._try_rule_based(question)
+        if sql_query is None:
+            return None
+        return self._result(question, schema, sql_query, 0.85, f"Rule-based SQL for: '{question}'")
+    
+    def _try_rule_based(self, question: str) -> Optional[str]:
+        """Return heuristic SQL only when the question's intent is unambiguous."""
+        hits = _classify(question)
+        if 'measure' not in hits or hits & {'complex', 'non_sum'} or {'sales', 'quantity'} <= hits:
+            return None
+        if hits & {'region', 'product', 'month'} not in _RULE_DIMENSIONS:
+            return None
+        q = question.lower()
+        if _FILTER_LITERAL_RE.search(q):
+            return None
+        # Numbers are only understood as a top-N limit
+        numbers = set(_NUMBER_RE.findall(q))
+        if numbers and ('top' not in hits or not numbers <= _LIMIT_NUMBERS):
+            return None
+        return self._fallback_sql(question)
+    
+    def _route_model(self, question: str) -> str:
+        """Send short questions without complex intent to the cheaper model."""
+        if len(question.split()) < 20 and 'complex' not in _classify(question):
+            return self.fast_model
+        return self.model
+    
+    async def _embed(self, question: str) -> Optional[List[float]]:
+        """Embed the normalized question for semantic cache lookups.
 
-Question: {question}
+        A single attempt within ``embedding_timeout`` keeps the cache lookup
+        from eating into the completion's retry budget.
+        """
+        try:
+            response = await self._call_provider(
+                self.client.embeddings.create,
+                {"model": self.embedding_model, "input": normalize_question(question)},
+                attempts=1, budget=self.embedding_timeout
+            )
+            return response.data[0].embedding
+        except Exception as e:
+            logger.warning(f"Error embedding question: {e}")
+            return None
+    
+    def _build_prompt(self, question: str, schema: Dict, examples: Optional[List] = None) -> str:
+        """Build a comprehensive prompt for SQL generation.
 
-Return only the SQL query that answers the question.
-"""
+        Sections are emitted static-first (guidelines, schema, examples) so
+        identical requests share a byte-stable prefix that the provider can
+        cache; the question is always the last thing in the prompt.
+        """
+        
+        # Schema description
+        schema_desc = self._format_schema(schema)
         
-        return prompt
+        # Examples
+        parts = [GUIDELINES, SCHEMA_INTRO, schema_desc, "\n"]
+        if examples:
+            parts.append(EXAMPLES_HEADER)
+            for example in examples:
+                parts.append(f"Question: {example.get('question', '')}\nSQL: {example.get('sql', '')}\n\n")
+        else:
+            parts.append(DEFAULT_EXAMPLES)
+        parts.append(f"\nQuestion: {question}\n")
+        return "".join(parts)
     
-    def _format_schema(self, schema: Dict) -> str:
+    @staticmethod
+    def _format_schema(schema: Dict) -> str:
         """Format schema for prompt"""
-        schema_text = "Database Schema:\n"
-        for table_name, table_info in schema.get("tables", {}).items():
-            schema_text += f"\nTable: {table_name}\n"
-            for col_name, col_info in table_info.get("columns", {}).items():
-                schema_text += f"  - {col_name} ({col_info.get('type', 'TEXT')}): {col_info.get('description', '')}\n"
-        return schema_text
-    
-    def _generate_suggestions(self, question: str, schema: Dict) -> Dict[str, List[str]]:
+        if schema is _DEFAULT_SCHEMA:
+            return _DEFAULT_SCHEMA_TEXT
+        return _render_schema(_freeze_schema(schema))
+    
+    def _generate_suggestions(self, question: str, schema: Dict) -> Dict[str, Tuple[str, ...]]:
         """Generate visualization and follow-up suggestions"""
-        
-        # Rule-based suggestions
-        question_lower = question.lower()
-        
-        # Visualization suggestions
-        visualizations = []
-        if any(word in question_lower for word in ['vendas', 'sales', 'amount', 'quantidade']):
-            if any(word in question_lower for word in ['região', 'region', 'produto', 'product']):
-                visualizations.append('bar_chart')
-            elif any(word in question_lower for word in ['tempo', 'time', 'mês', 'month', 'crescimento', 'variação', 'evolução']):
-                visualizations.append('line_chart')
-            else:
-                visualizations.append('pie_chart')
-        else:
-            visualizations.append('table')
-        
-        # Follow-up questions
-        follow_up_questions = []
-        if 'região' in question_lower or 'region' in question_lower:
-            follow_up_questions.append("Quais regiões tiveram melhor performance?")
-            follow_up_questions.append("Compare vendas por região e produto")
-        elif 'produto' in question_lower or 'product' in question_lower:
-            follow_up_questions.append("Qual produto teve maior crescimento?")
-            follow_up_questions.append("Mostre vendas por produto ao longo do tempo")
-        else:
-            follow_up_questions.append("Quero vendas por região no mês de maio")
-            follow_up_questions.append("Mostre os top 5 produtos por quantidade vendida")
-        
-        return {
-            "visualizations": visualizations,
-            "follow_up_questions": follow_up_questions
-        }
+        return _SUGGESTION_TABLE[_classify(question) & _SUGGESTION_CLASSES]
 
     def _fallback_sql(self, question: str) -> str:
         """Heuristic SQL generator for SQLite based on question keywords."""
-        q = (question or '').lower()
+        hits = _classify(question)
         table = 'sales'
         measure = 'sales_amount'
-        if 'quantidade' in q or 'quantity' in q:
+        if 'quantity' in hits:
             measure = 'quantity'
-        has_region = 'região' in q or 'region' in q
-        has_product = 'produto' in q or 'product' in q
-        has_month = 'mês' in q or 'mes' in q or 'month' in q or 'tempo' in q or 'tend' in q or 'crescimento' in q or 'variação' in q or 'evolução' in q
-        wants_top = 'top' in q or 'maiores' in q or 'rank' in q or 'melhores' in q
-        limit = 10 if '10' in q else (5 if '5' in q or 'cinco' in q else 0)
+        has_region = 'region' in hits
+        has_product = 'product' in hits
+        has_month = 'month' in hits
+        wants_top = 'top' in hits
+        limit = 10 if 'ten' in hits else (5 if 'five' in hits else 0)
 
         select_cols: List[str] = []
         group_cols: List[str] = []
@@ -242,3 +620,15 @@ Return only the SQL query that answers the question.
 
         sql = f"SELECT {select_clause} FROM {table}{group_clause}{order_clause}{limit_clause}"
         return sql
+
+
+# Built once at import so every request shares one pool, cache and breaker
+_SERVICE = LLMService()
+
+
+async def get_llm_service() -> LLMService:
+    """FastAPI dependency returning the process-wide LLMService.
+
+    Async so FastAPI resolves it on the event loop instead of a threadpool.
+    """
+    return _SERVICE
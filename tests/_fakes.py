@@ -0,0 +1,23 @@
+from types import MappingProxyType
+
+_DUMMY_RESPONSE = MappingProxyType({
+    "query": "SELECT * FROM sales LIMIT 1",
+    "confidence": 0.99,
+    "explanation": "ok",
+    "suggested_visualizations": ("table",),
+    "suggested_follow_up_questions": ("more?",)
+})
+
+
+class DummyLLM:
+    __slots__ = ()
+
+    async def generate_query(self, request):
+        return _DUMMY_RESPONSE
+
+    async def stream_query(self, request):
+        yield {"delta": _DUMMY_RESPONSE["query"]}
+        yield {"result": dict(_DUMMY_RESPONSE)}
+
+
+_DUMMY = DummyLLM()
@@ -0,0 +1,39 @@
+import httpx
+import pytest
+import pytest_asyncio
+from pytest_asyncio import is_async_test
+
+from tests._fakes import _DUMMY
+
+
+def pytest_collection_modifyitems(items):
+    # Run every async test on the session loop the shared ASGI client lives on
+    session_loop = pytest.mark.asyncio(scope="session")
+    for item in items:
+        if is_async_test(item):
+            item.add_marker(session_loop, append=False)
+
+
+@pytest.fixture(scope="session")
+def app():
+    # Imported here so the FastAPI app is built once per worker, at first use
+    from app.main import app as _app
+    return _app
+
+
+@pytest.fixture(autouse=True, scope="session")
+def _stub_llm(app):
+    from app.services.llm_service import get_llm_service
+
+    async def _dummy_service():
+        return _DUMMY
+
+    app.dependency_overrides[get_llm_service] = _dummy_service
+    yield
+    app.dependency_overrides.clear()
+
+
+@pytest_asyncio.fixture(scope="session")
+async def client(app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c:
+        yield c
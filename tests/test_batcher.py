@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app.services.batcher import CompletionBatcher
+
+
+async def test_batcher_coalesces_identical_requests():
+    calls = []
+
+    async def create(**params):
+        calls.append(params)
+        await asyncio.sleep(0)
+        return params["q"].upper()
+
+    batcher = CompletionBatcher(create, window=0.01)
+    results = await asyncio.gather(
+        batcher.submit({"q": "a"}), batcher.submit({"q": "b"}), batcher.submit({"q": "a"})
+    )
+
+    await batcher.close()
+
+    assert results == ["A", "B", "A"]
+    assert len(calls) == 2
+
+
+async def test_batcher_propagates_errors_to_callers():
+    async def create(**params):
+        raise RuntimeError("boom")
+
+    batcher = CompletionBatcher(create, window=0.0)
+    with pytest.raises(RuntimeError):
+        await batcher.submit({"q": "a"})
+    await batcher.close()
+
+
+async def test_next_batch_starts_while_previous_is_in_flight():
+    release = asyncio.Event()
+
+    async def create(**params):
+        if params["q"] == "slow":
+            await release.wait()
+        return params["q"]
+
+    batcher = CompletionBatcher(create, window=0.01)
+    slow = asyncio.ensure_future(batcher.submit({"q": "slow"}))
+    await asyncio.sleep(0.05)
+
+    assert await asyncio.wait_for(batcher.submit({"q": "fast"}), timeout=1.0) == "fast"
+    assert not slow.done()
+
+    release.set()
+    assert await slow == "slow"
+    await batcher.close()
+
+
+async def test_close_fails_in_flight_requests():
+    async def create(**params):
+        await asyncio.Event().wait()
+
+    batcher = CompletionBatcher(create, window=0.0)
+    pending = asyncio.ensure_future(batcher.submit({"q": "a"}))
+    await asyncio.sleep(0.01)
+
+    await batcher.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        await asyncio.wait_for(pending, timeout=1.0)
@@ -0,0 +1,89 @@
+import orjson
+
+from app.services.cache_service import ResponseCache, SemanticCache, hash_payload
+
+
+def test_response_cache_key_normalizes_question():
+    context = ResponseCache.context_key(hash_payload({"tables": {}}), None)
+    other = ResponseCache.context_key(hash_payload({"tables": {"x": {}}}), None)
+
+    assert ResponseCache.make_key(" Vendas ", context) == ResponseCache.make_key("vendas", context)
+    assert ResponseCache.make_key("vendas", context) != ResponseCache.make_key("vendas", other)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = {}
+        self.closed = False
+
+    async def get(self, key):
+        return self.store.get(key)
+
+    async def setex(self, key, ttl, value):
+        self.store[key] = value
+
+    async def aclose(self):
+        self.closed = True
+
+
+async def test_response_cache_reads_through_async_redis_tier():
+    cache = ResponseCache()
+    cache._redis = FakeRedis()
+
+    await cache.set("k", {"query": "SELECT 1"})
+    assert orjson.loads(cache._redis.store["nlq:k"]) == {"query": "SELECT 1"}
+
+    cache.clear()
+    assert await cache.get("k") == {"query": "SELECT 1"}
+    assert await cache.get("missing") is None
+
+    redis_client = cache._redis
+    await cache.aclose()
+    assert redis_client.closed
+
+
+def test_hash_payload_ignores_key_order():
+    assert hash_payload({"a": 1, "b": [1, 2]}) == hash_payload({"b": [1, 2], "a": 1})
+
+
+def test_hash_payload_accepts_values_orjson_rejects():
+    big = 2 ** 70
+    assert hash_payload({"a": big, "b": 1}) == hash_payload({"b": 1, "a": big})
+    assert hash_payload({"a": big}) != hash_payload({"a": big + 1})
+
+
+def test_semantic_cache_matches_similar_vectors_per_schema():
+    cache = SemanticCache(threshold=0.9, maxsize=2)
+    result = {"query": "SELECT 1"}
+
+    assert cache.lookup([1.0, 0.0], "s1") is None
+    cache.add([2.0, 0.1], "s1", result)
+
+    assert cache.lookup([1.0, 0.05], "s1") is result
+    assert cache.lookup([0.0, 1.0], "s1") is None
+    assert cache.lookup([1.0, 0.05], "s2") is None
+
+
+def test_semantic_cache_evicts_oldest_entry_when_full():
+    cache = SemanticCache(threshold=0.99, maxsize=2)
+    cache.add([1.0, 0.0, 0.0], "s", {"query": "a"})
+    cache.add([0.0, 1.0, 0.0], "s", {"query": "b"})
+    cache.add([0.0, 0.0, 1.0], "s", {"query": "c"})
+
+    assert cache.lookup([1.0, 0.0, 0.0], "s") is None
+    assert cache.lookup([0.0, 0.0, 1.0], "s") == {"query": "c"}
+
+
+def test_semantic_cache_evicts_least_recently_used_context():
+    cache = SemanticCache(threshold=0.99, maxsize=2)
+    cache.add([1.0, 0.0], "s1", {"query": "a"})
+    cache.add([1.0, 0.0], "s2", {"query": "b"})
+    assert cache.lookup([1.0, 0.0], "s1") == {"query": "a"}
+
+    # A third context exceeds the global cap and drops s2, the least recently used
+    cache.add([1.0, 0.0], "s3", {"query": "c"})
+
+    assert cache.lookup([1.0, 0.0], "s2") is None
+    assert cache.lookup([1.0, 0.0], "s1") == {"query": "a"}
+    assert cache.lookup([1.0, 0.0], "s3") == {"query": "c"}
+    assert cache._rows <= cache.maxsize
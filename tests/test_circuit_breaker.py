@@ -0,0 +1,36 @@
+from app.services.circuit_breaker import CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_on_error_rate_and_resets():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_rate=0.2, window=30.0, min_calls=5, reset_timeout=30.0, clock=clock)
+
+    for _ in range(4):
+        breaker.record(True)
+    assert breaker.allow()
+
+    breaker.record(False)
+    breaker.record(False)
+    assert not breaker.allow()
+
+    clock.now = 31.0
+    assert breaker.allow()
+
+
+def test_breaker_ignores_calls_outside_window():
+    clock = Clock()
+    breaker = CircuitBreaker(min_calls=2, window=30.0, clock=clock)
+
+    breaker.record(False)
+    clock.now = 40.0
+    breaker.record(True)
+
+    assert breaker.allow()
@@ -0,0 +1,300 @@
+import re
+from types import SimpleNamespace
+
+import httpx
+from openai import APIConnectionError
+
+from app.models.query_request import QueryRequest
+from app.services.cache_service import SemanticCache
+from app.services.llm_service import LLMService, GUIDELINES, DEFAULT_EXAMPLES, SYSTEM_PROMPT, _DEFAULT_SCHEMA, _classify
+
+
+class FakeCompletions:
+    def __init__(self, sql="SELECT region, SUM(sales_amount) FROM sales GROUP BY region"):
+        self.sql = sql
+        self.calls = 0
+        self.stream_error = None
+        self.finish_reason = "stop"
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if kwargs.get("stream"):
+            return self._stream()
+        message = SimpleNamespace(content=self.sql)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=self.finish_reason)])
+
+    async def _stream(self):
+        for token in self.sql.split(" "):
+            if self.stream_error is not None:
+                raise self.stream_error
+            delta = SimpleNamespace(content=token + " ")
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)])
+        done = SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason=self.finish_reason)
+        yield SimpleNamespace(choices=[done])
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = 0
+        self.timeouts = []
+        self.error = None
+
+    async def create(self, model, input, timeout=None):
+        self.calls += 1
+        self.timeouts.append(timeout)
+        if self.error is not None:
+            raise self.error
+        vector = [1.0, 0.0] if "região" in input else [0.0, 1.0]
+        return SimpleNamespace(data=[SimpleNamespace(embedding=vector)])
+
+
+def make_service():
+    service = LLMService()
+    completions = FakeCompletions()
+    service.client = SimpleNamespace(chat=SimpleNamespace(completions=completions), embeddings=FakeEmbeddings())
+    return service, completions
+
+
+def test_classify_matches_overlapping_keywords():
+    assert _classify("Top 10 produtos por QUANTIDADE") == {"top", "ten", "product", "quantity", "measure"}
+    assert _classify("tendência por região") == {"month", "region"}
+    assert _classify("") == frozenset()
+
+
+def test_route_model_prefers_fast_model_for_simple_questions():
+    service = LLMService()
+
+    assert service._route_model("vendas por região") == service.fast_model
+    assert service._route_model("compare o crescimento por região") == service.model
+    assert service._route_model(" ".join(["vendas"] * 25)) == service.model
+
+
+def test_prompt_keeps_static_prefix_and_question_last():
+    service = LLMService()
+    schema = {"tables": {"sales": {"columns": {"id": {"type": "INTEGER", "description": "Primary key"}}}}}
+
+    first = service._build_prompt("vendas por região?", schema)
+    second = service._build_prompt("top 5 produtos", schema)
+
+    assert first.startswith(GUIDELINES)
+    assert DEFAULT_EXAMPLES in first
+    assert first.endswith("Question: vendas por região?\n")
+    prefix = first[: -len("vendas por região?\n")]
+    assert second.startswith(prefix)
+
+
+def test_default_prompt_prefix_is_long_enough_for_provider_caching():
+    prefix = SYSTEM_PROMPT + LLMService()._build_prompt("", _DEFAULT_SCHEMA)
+
+    # ~4 characters per token keeps the static prefix above the 1024-token minimum
+    assert len(prefix) > 4 * 1024
+
+
+def test_default_examples_follow_alias_guideline():
+    prefixes = {"SUM": "total", "AVG": "avg"}
+    aliases = re.findall(r"(SUM|AVG)\((\w+)\) AS (\w+)", DEFAULT_EXAMPLES)
+
+    assert aliases
+    for func, column, alias in aliases:
+        assert alias == f"{prefixes[func]}_{column}"
+
+
+async def test_repeated_question_is_served_from_cache():
+    service, completions = make_service()
+
+    first = await service.generate_query(QueryRequest(question="Vendas por região"))
+    second = await service.generate_query(QueryRequest(question="  vendas   por\tregião "))
+
+    assert completions.calls == 1
+    assert second["query"] == first["query"]
+    assert second["explanation"] == "Cached SQL query for: '  vendas   por\tregião '"
+
+
+async def test_no_cache_flag_bypasses_cache():
+    service, completions = make_service()
+    request = QueryRequest(question="Vendas por região", examples=[{"no_cache": True}])
+
+    await service.generate_query(request)
+    await service.generate_query(request)
+
+    assert completions.calls == 2
+
+
+async def test_paraphrased_question_hits_semantic_cache():
+    service, completions = make_service()
+    service.semantic_cache = SemanticCache()
+
+    first = await service.generate_query(QueryRequest(question="vendas por região em maio"))
+    second = await service.generate_query(QueryRequest(question="mostrar região de maio"))
+    await service.generate_query(QueryRequest(question="top 5 produtos"))
+
+    assert second["query"] == first["query"]
+    assert second["explanation"] == "Cached SQL query for: 'mostrar região de maio'"
+    # Suggestions follow the paraphrase's own keywords, not the cached question's
+    assert first["suggested_visualizations"] == ("bar_chart",)
+    assert second["suggested_visualizations"] == ("table",)
+    assert completions.calls == 2
+
+
+async def test_stream_query_yields_deltas_then_cached_result():
+    service, completions = make_service()
+    request = QueryRequest(question="vendas por região")
+
+    events = [event async for event in service.stream_query(request)]
+    deltas = "".join(event["delta"] for event in events[:-1])
+
+    assert deltas.strip() == completions.sql
+    assert events[-1]["result"]["query"] == completions.sql
+    assert (await service.generate_query(request))["query"] == events[-1]["result"]["query"]
+    assert completions.calls == 1
+
+
+async def test_rule_shortcut_skips_llm_for_unambiguous_questions():
+    service, completions = make_service()
+    service.rule_shortcut = True
+
+    simple = await service.generate_query(QueryRequest(question="vendas por região"))
+    top = await service.generate_query(QueryRequest(question="top 5 maiores vendas por produto"))
+    await service.generate_query(QueryRequest(question="compare o crescimento de vendas por região"))
+    custom = await service.generate_query(QueryRequest(question="vendas por região", schema={"tables": {}}))
+
+    assert simple["confidence"] == 0.85
+    assert simple["query"] == service._fallback_sql("vendas por região")
+    assert top["confidence"] == 0.85
+    assert custom["query"] == completions.sql
+    assert completions.calls == 2
+
+    # Filters the heuristic SQL cannot express go to the LLM
+    for question in [
+        "vendas por região em maio",
+        "vendas da região North",
+        "quantidade por produto em janeiro",
+        "vendas do Produto A por região",
+        "vendas por região em 2024",
+    ]:
+        result = await service.generate_query(QueryRequest(question=question))
+        assert result["query"] == completions.sql, question
+    assert completions.calls == 7
+
+    # So do averages, counts and ascending rankings
+    for question in [
+        "média de vendas por região",
+        "average sales by region",
+        "quantas vendas por região",
+        "número de vendas por produto",
+        "menores vendas por produto",
+        "piores vendas por produto",
+    ]:
+        result = await service.generate_query(QueryRequest(question=question))
+        assert result["query"] == completions.sql, question
+    assert completions.calls == 13
+
+
+async def test_client_is_created_lazily_and_closed(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    service = LLMService()
+
+    assert "client" not in service.__dict__
+    client = service.client
+    assert service.client is client
+
+    await service.aclose()
+    assert "client" not in service.__dict__
+
+
+async def test_transient_errors_are_retried_then_breaker_falls_back():
+    service, completions = make_service()
+    service.retry_attempts = 2
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    create = completions.create
+    failures = [APIConnectionError(request=request)]
+
+    async def flaky_create(**kwargs):
+        if failures:
+            raise failures.pop()
+        return await create(**kwargs)
+
+    completions.create = flaky_create
+    result = await service.generate_query(QueryRequest(question="vendas por região"))
+    assert result["query"] == completions.sql
+
+    service.breaker._opened_at = service.breaker._clock()
+    fallback = await service.generate_query(QueryRequest(question="top 5 produtos"))
+    assert fallback["confidence"] == 0.6
+    assert "circuit open" in fallback["explanation"]
+
+
+async def test_without_api_key_uses_heuristic_sql(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    service = LLMService()
+    request = QueryRequest(question="top 10 produtos por quantidade ao longo do tempo")
+
+    result = await service.generate_query(request)
+    events = [event async for event in service.stream_query(request)]
+
+    assert result["confidence"] == 0.7
+    assert result["query"] == (
+        "SELECT month, product, SUM(quantity) AS total_quantity FROM sales"
+        " GROUP BY month, product ORDER BY total_quantity DESC LIMIT 10"
+    )
+    assert events == [{"delta": result["query"]}, {"result": result}]
+
+
+async def test_schema_with_oversized_integer_still_generates():
+    service, completions = make_service()
+    schema = {"tables": {"sales": {"columns": {}, "max_id": 2 ** 70}}}
+
+    result = await service.generate_query(QueryRequest(question="vendas", schema=schema))
+
+    assert result["query"] == completions.sql
+
+
+async def test_open_circuit_skips_embedding_call():
+    service, completions = make_service()
+    service.semantic_cache = SemanticCache()
+    service.breaker._opened_at = service.breaker._clock()
+
+    result = await service.generate_query(QueryRequest(question="vendas por região"))
+
+    assert service.client.embeddings.calls == 0
+    assert completions.calls == 0
+    assert result["confidence"] == 0.6
+
+
+async def test_stream_failures_count_towards_breaker():
+    service, completions = make_service()
+    completions.stream_error = RuntimeError("stream dropped")
+
+    events = [event async for event in service.stream_query(QueryRequest(question="vendas por região"))]
+
+    assert events[-1]["result"]["confidence"] == 0.6
+    assert [ok for _, ok in service.breaker._calls] == [False]
+
+
+async def test_truncated_completion_falls_back_and_is_not_cached():
+    service, completions = make_service()
+    completions.finish_reason = "length"
+    request = QueryRequest(question="vendas por região")
+
+    result = await service.generate_query(request)
+    events = [event async for event in service.stream_query(request)]
+    await service.generate_query(request)
+
+    assert result["confidence"] == 0.6
+    assert result["query"] == service._fallback_sql("vendas por região")
+    assert events[-1]["result"] == result
+    assert completions.calls == 3
+
+
+async def test_embedding_gets_one_short_attempt_before_completion():
+    service, completions = make_service()
+    service.semantic_cache = SemanticCache()
+    embeddings = service.client.embeddings
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    embeddings.error = APIConnectionError(request=request)
+
+    result = await service.generate_query(QueryRequest(question="vendas por região"))
+
+    assert embeddings.calls == 1
+    assert embeddings.timeouts[0] <= service.embedding_timeout
+    assert result["query"] == completions.sql
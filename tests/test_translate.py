@@ -1,26 +1,31 @@
 import asyncio
-from fastapi.testclient import TestClient
-from app.main import app
-from app.services import llm_service
 
-client = TestClient(app)
+import orjson
+import pytest
 
-class DummyLLM:
-    def generate_query(self, request):
-        return {
-            "query": "SELECT * FROM sales LIMIT 1",
-            "confidence": 0.99,
-            "explanation": "ok",
-            "suggested_visualizations": ["table"],
-            "suggested_follow_up_questions": ["more?"]
-        }
+JSON_HEADERS = {"content-type": "application/json"}
 
-def test_translate_ok(monkeypatch):
-    monkeypatch.setattr(llm_service, "LLMService", lambda: DummyLLM())
 
-    resp = client.post("/translate/", json={"question": "vendas?"})
+@pytest.mark.parametrize("questions", [
+    ["vendas?"],
+    ["vendas por região", "top 5 produtos", "vendas por mês ao longo do tempo", "compare produto e região"],
+])
+async def test_translate_ok(client, questions):
+    responses = await asyncio.gather(*(
+        client.post("/translate/", content=orjson.dumps({"question": q}), headers=JSON_HEADERS)
+        for q in questions
+    ))
+    for resp in responses:
+        assert resp.status_code == 200
+        data = orjson.loads(resp.content)
+        assert data["query"].lower().startswith("select")
+        assert data["confidence"] > 0.5
+        assert isinstance(data["suggested_visualizations"], list)
+
+
+async def test_translate_stream(client):
+    resp = await client.post("/translate/stream", content=orjson.dumps({"question": "vendas por região"}), headers=JSON_HEADERS)
     assert resp.status_code == 200
-    data = resp.json()
-    assert data["query"].lower().startswith("select")
-    assert data["confidence"] > 0.5
-    assert isinstance(data["suggested_visualizations"], list)
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    events = [line for line in resp.text.splitlines() if line.startswith("data: ")]
+    assert "result" in orjson.loads(events[-1][len("data: "):])